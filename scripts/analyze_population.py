@@ -4,20 +4,24 @@ NZ 250m Grid population analysis + LLM report & PDF generation
 Merged and cleaned version of provided code.
 """
 
+import io
 import os
-import math
 import time
 import json
+import asyncio
 import datetime
 import requests
 import codecs
 
+import numpy as np
 import pandas as pd
-import re
 import geopandas as gpd
+import shapely
 import matplotlib.pyplot as plt
 import seaborn as sns
 from matplotlib.ticker import FuncFormatter
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
 from pyproj import Transformer
 from fpdf import FPDF
 from fpdf.enums import XPos, YPos
@@ -32,44 +36,111 @@ except ImportError:
 
 model_name = "llama2"  # change if needed
 
+# --- Optional fast choropleth rendering (datashader) ---
+try:
+    import datashader as ds  # type: ignore
+    _DATASHADER_OK = True
+except ImportError:
+    ds = None
+    _DATASHADER_OK = False
+
+# --- LLM backend ---
+# "ollama" (default) or "llamacpp" for a llama.cpp `llama-server` exposing the
+# OpenAI-compatible API, e.g.:
+#   ./llama-server -m llama-2-7b.Q4_K_M.gguf --ctx-size 2048 --parallel 8 \
+#       --cont-batching --host 127.0.0.1 --port 8080
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "ollama")
+LLAMA_SERVER_URL = os.environ.get("LLAMA_SERVER_URL", "http://127.0.0.1:8080")
+
+def wait_for_llama_server(timeout=300):
+    """Block until llama-server has finished loading its model (/health returns 200)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            resp = requests.get(f"{LLAMA_SERVER_URL}/health", timeout=5)
+            if resp.status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(2)
+    return False
+
+if LLM_BACKEND == "llamacpp":
+    print(f"Waiting for llama-server at {LLAMA_SERVER_URL} to load the model...")
+    _LLM_OK = wait_for_llama_server()
+    if not _LLM_OK:
+        print(f"Warning: llama-server at {LLAMA_SERVER_URL} is not ready. LLM output will be disabled.")
+else:
+    _LLM_OK = _OLLAMA_OK
+
+# Ollama: load the model once up front and keep it resident (keep_alive=-1) so
+# neither the first request nor later ones pay a cold start.
+OLLAMA_KEEP_ALIVE = -1
+if LLM_BACKEND == "ollama" and _LLM_OK:
+    try:
+        print(f"Preloading Ollama model {model_name}...")
+        ollama.Client().generate(model=model_name, prompt="", keep_alive=OLLAMA_KEEP_ALIVE, options={'num_predict': 1})
+    except Exception as e:
+        print(f"Warning: Could not preload Ollama model {model_name} ({e}).")
+
 # --- Load grid data ---
 # Adjust path as needed
+# The GeoParquet written by preprocess_population.py is preferred; the raw
+# GeoJSON is only parsed when it has not been generated yet.
+GEOPARQUET_PATH = "../data/nz_population.parquet"
 GEOJSON_PATH = "../data/nz_population.geojson"
+# Only these attributes are parsed; pyogrio skips all other fields at read time
+GRID_COLUMNS = ['GridID', 'PopEst2023', 'CENTROID_X', 'CENTROID_Y']
 try:
-    grid = gpd.read_file(GEOJSON_PATH)
+    if os.path.exists(GEOPARQUET_PATH):
+        grid = gpd.read_parquet(GEOPARQUET_PATH)
+    else:
+        print(f"Note: {GEOPARQUET_PATH} not found. Run preprocess_population.py to create it; reading GeoJSON instead.")
+        grid = gpd.read_file(GEOJSON_PATH, engine="pyogrio", columns=GRID_COLUMNS)
 except Exception as e:
-    print(f"Error: Could not read GeoJSON file at {GEOJSON_PATH}. Please ensure the file exists and is valid.")
+    print(f"Error: Could not read grid data from {GEOPARQUET_PATH} or {GEOJSON_PATH}. Please ensure the file exists and is valid.")
     print(f"Details: {e}")
     exit()
 
-# keep columns you expect (defensive)
-expected_cols = ['GridID', 'PopEst2023', 'geometry', 'CENTROID_X', 'CENTROID_Y']
-existing = [c for c in expected_cols if c in grid.columns]
-grid = grid[existing].copy()
-
 # Check/convert coordinate system (NZTM2000)
 if grid.crs is None or grid.crs.to_epsg() != 2193:
     print("DEBUG: Reprojecting grid to EPSG:2193 (NZTM2000)")
     grid = grid.to_crs(epsg=2193)
 
+# Repair invalid geometries once up front so they cannot stall plotting later
+# (missing geometries are not "invalid" and are left alone)
+geometries = grid.geometry.values
+invalid_geometry = ~shapely.is_valid(geometries) & ~shapely.is_missing(geometries)
+if invalid_geometry.any():
+    print(f"DEBUG: Repairing {invalid_geometry.sum()} invalid geometries with shapely.make_valid")
+    grid.loc[invalid_geometry, 'geometry'] = shapely.make_valid(geometries[invalid_geometry])
+
 # --- Utilities ---
 
-def split_dataframe(df, chunk_size):
-    num_chunks = math.ceil(len(df) / chunk_size)
-    return [df.iloc[i*chunk_size:(i+1)*chunk_size].copy() for i in range(num_chunks)]
+# Nominatim responses are cached on disk across runs when requests_cache is
+# installed; either way one HTTPS session is reused for every lookup.
+try:
+    import requests_cache  # type: ignore
+    nominatim_session = requests_cache.CachedSession("nominatim_cache", backend="sqlite", expire_after=30*86400)
+except ImportError:
+    nominatim_session = requests.Session()
 
 cache = {}
 
 def get_placename_from_coords(lon, lat, email_contact="contact@example.com"):
-    key = (round(lon, 3), round(lat, 3))
+    # Round to ~1 km so neighbouring chunk centroids share a (persistent) cache entry
+    lon, lat = round(lon, 2), round(lat, 2)
+    key = (lon, lat)
     if key in cache:
         return cache[key]
 
     nominatim_url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}&zoom=10&addressdetails=1"
     headers = {'User-Agent': f'NZPopulationAnalysis/1.0 ({email_contact})'}
 
+    from_cache = False
     try:
-        resp = requests.get(nominatim_url, headers=headers, timeout=30)
+        resp = nominatim_session.get(nominatim_url, headers=headers, timeout=30)
+        from_cache = getattr(resp, 'from_cache', False)
         resp.raise_for_status()
         data = resp.json()
         addr = data.get('address', {})
@@ -85,21 +156,80 @@ def get_placename_from_coords(lon, lat, email_contact="contact@example.com"):
         print(f"Error during Nominatim request for {lat},{lon}: {e}")
         return f"Error Region ({lat:.2f},{lon:.2f})"
     finally:
-        time.sleep(1.0)
+        # Nominatim usage policy: at most one request per second (cache hits are free)
+        if not from_cache:
+            time.sleep(1.0)
+
+# Offline reverse geocoding: a layer of NZ place polygons (e.g. Stats NZ SA2 or
+# territorial authority boundaries) joined against the chunk centroids. When the
+# file is missing, placenames fall back to the Nominatim API above.
+PLACES_PATH = "../data/nz_places.gpkg"
+PLACES_NAME_COLUMN = "name"  # e.g. "SA22023_V1_00_NAME" for Stats NZ SA2
+
+def get_placenames_offline(xs, ys, lons, lats):
+    """Return one placename per centroid, or None if the places layer cannot be used."""
+    # Only the name field is parsed; pyogrio silently skips unknown columns
+    places = gpd.read_file(PLACES_PATH, engine="pyogrio", columns=[PLACES_NAME_COLUMN])
+    if PLACES_NAME_COLUMN not in places.columns:
+        print(f"Error: Column '{PLACES_NAME_COLUMN}' not found in {PLACES_PATH}. Set PLACES_NAME_COLUMN to the layer's name field.")
+        return None
+    if places.crs is None or places.crs.to_epsg() != 2193:
+        places = places.to_crs(epsg=2193)
+    places = places[[PLACES_NAME_COLUMN, 'geometry']]
+
+    centroids_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(xs, ys), crs="EPSG:2193")
+    # "intersects" (not "within") so a centroid lying exactly on a boundary is
+    # still named; it then matches every polygon sharing that edge, so keep the first
+    joined = gpd.sjoin(centroids_gdf, places, how="left", predicate="intersects")
+    names = joined[~joined.index.duplicated(keep='first')][PLACES_NAME_COLUMN]
+
+    return [
+        name if isinstance(name, str) and name else f"Unknown Region ({lat:.2f},{lon:.2f})"
+        for name, lon, lat in zip(names, lons, lats)
+    ]
 
 # --- LLM and Text Processing Utilities ---
-def generate_text(prompt: str) -> str:
-    if not _OLLAMA_OK:
+# All LLM requests are issued concurrently, bounded by a semaphore sized to the
+# server's parallel slots. Start Ollama with a matching OLLAMA_NUM_PARALLEL
+# (and OLLAMA_MAX_LOADED_MODELS=1), or llama-server with a matching --parallel,
+# so the requests are batched together.
+if LLM_BACKEND == "llamacpp":
+    LLM_CONCURRENCY = int(os.environ.get("LLAMA_SERVER_PARALLEL", 8))
+else:
+    LLM_CONCURRENCY = int(os.environ.get("OLLAMA_NUM_PARALLEL", 4))
+
+def llama_server_chat(prompt: str, options: dict = None, format: dict = None) -> str:
+    options = options or {}
+    payload = {'model': model_name, 'messages': [{'role': 'user', 'content': prompt}]}
+    if format:
+        payload['response_format'] = {'type': 'json_schema', 'json_schema': {'schema': format}}
+    if 'num_predict' in options:
+        payload['max_tokens'] = options['num_predict']
+    if 'temperature' in options:
+        payload['temperature'] = options['temperature']
+    resp = requests.post(f"{LLAMA_SERVER_URL}/v1/chat/completions", json=payload, timeout=600)
+    resp.raise_for_status()
+    return resp.json()['choices'][0]['message']['content']
+
+async def generate_text(client, semaphore, prompt: str, options: dict = None, format: dict = None) -> str:
+    if not _LLM_OK:
         first_line = next((ln for ln in prompt.splitlines() if ln.strip()), "")
         return f"[LLM disabled] {first_line[:200]}{ '...' if len(first_line) > 200 else '' }"
     try:
-        print("Querying LLM...")
-        resp = ollama.chat(model=model_name, messages=[{'role': 'user', 'content': prompt}])
-        if isinstance(resp, dict) and 'message' in resp and isinstance(resp['message'], dict):
-            return resp['message'].get('content', str(resp))
-        return str(resp)
+        async with semaphore:
+            print("Querying LLM...")
+            if LLM_BACKEND == "llamacpp":
+                return await asyncio.to_thread(llama_server_chat, prompt, options, format)
+            extra = {'format': format} if format else {}
+            resp = await client.chat(model=model_name, messages=[{'role': 'user', 'content': prompt}], options=options, keep_alive=OLLAMA_KEEP_ALIVE, **extra)
+        # Plain dicts (older ollama clients) and ChatResponse/Message objects
+        # (ollama>=0.4) both support subscripting
+        try:
+            return resp['message']['content']
+        except (KeyError, TypeError):
+            return str(resp)
     except Exception as e:
-        print(f"Ollama call failed: {e}")
+        print(f"LLM call failed: {e}")
         return f"[Error generating text: {e}]"
 
 def clean_llm_output(text: str) -> str:
@@ -119,7 +249,20 @@ def clean_llm_output(text: str) -> str:
     return text
 
 # --- Main Processing ---
-chunks = split_dataframe(grid, 10000)
+# Chunks are square NZTM tiles, so each one is a contiguous region with a
+# meaningful centroid (row-order chunks mixed unrelated parts of the country).
+TILE_SIZE = 50000  # metres
+
+for col in ('PopEst2023', 'CENTROID_X', 'CENTROID_Y'):
+    if col not in grid.columns:
+        print(f"Error: Grid data is missing required column '{col}'.")
+        exit()
+
+# Downcast numeric columns so the per-chunk aggregations move fewer bytes
+# (float32 keeps NZTM coordinates to within half a metre)
+grid['PopEst2023'] = pd.to_numeric(grid['PopEst2023'], downcast='integer')
+grid[['CENTROID_X', 'CENTROID_Y']] = grid[['CENTROID_X', 'CENTROID_Y']].astype('float32')
+
 transformer = Transformer.from_crs("epsg:2193", "epsg:4326", always_xy=True)
 
 reports = []
@@ -127,99 +270,215 @@ policy_suggestions = []
 chunk_populations = []
 chunk_livability = []
 
-for i, chunk in enumerate(chunks):
-    print(f"--- Processing Chunk {i+1}/{len(chunks)} (Size: {len(chunk)}) ---")
-    if chunk.empty or 'CENTROID_X' not in chunk.columns or 'CENTROID_Y' not in chunk.columns:
-        print("Skipping empty or invalid chunk.")
-        continue
-
-    chunk_centroid_x = chunk['CENTROID_X'].mean()
-    chunk_centroid_y = chunk['CENTROID_Y'].mean()
-
-    if pd.isna(chunk_centroid_x) or pd.isna(chunk_centroid_y):
-        print("Skipping chunk with invalid centroid.")
-        continue
-
-    try:
-        wgs84_lon, wgs84_lat = transformer.transform(chunk_centroid_x, chunk_centroid_y)
-    except Exception as e:
-        print(f"Coordinate transform failed: {e}")
-        continue
-
-    chunk_placename = get_placename_from_coords(wgs84_lon, wgs84_lat)
-    print(f"Chunk placename: {chunk_placename}")
+# Pass 1: per-chunk summary statistics and centroids in one grouped pass
+missing_centroid = grid['CENTROID_X'].isna() | grid['CENTROID_Y'].isna()
+if missing_centroid.any():
+    print(f"Skipping {missing_centroid.sum()} grid cell(s) with invalid centroid.")
+# Cells without a centroid get a NaN tile and are dropped by groupby
+grid['chunk_id'] = (grid['CENTROID_X'] // TILE_SIZE) * 10000 + (grid['CENTROID_Y'] // TILE_SIZE)
+grouped = grid.groupby('chunk_id')
+summaries = grouped['PopEst2023'].agg(['mean', 'sum', 'max', 'min'])
+centroids = grouped[['CENTROID_X', 'CENTROID_Y']].mean()
+print(f"--- Summarised {len(summaries)} chunks ({TILE_SIZE / 1000:g} km tiles) ---")
+
+# Transform all chunk centroids to WGS84 in a single PROJ call
+xs = centroids['CENTROID_X'].to_numpy(dtype=float)
+ys = centroids['CENTROID_Y'].to_numpy(dtype=float)
+try:
+    lons, lats = transformer.transform(xs, ys)
+except Exception as e:
+    print(f"Coordinate transform failed: {e}")
+    exit()
 
-    if 'PopEst2023' not in chunk.columns:
-        print("Skipping chunk missing PopEst2023.")
+placenames = None
+if os.path.exists(PLACES_PATH):
+    print(f"--- Resolving placenames offline from {PLACES_PATH} ---")
+    placenames = get_placenames_offline(xs, ys, lons, lats)
+    if placenames is None:
+        print("Falling back to Nominatim reverse geocoding.")
+else:
+    print(f"Note: {PLACES_PATH} not found. Falling back to Nominatim reverse geocoding.")
+
+used_nominatim = placenames is None
+if used_nominatim:
+    placenames = [get_placename_from_coords(lon, lat) for lon, lat in zip(lons, lats)]
+
+# Chunks below this total population get a templated report instead of LLM calls
+MIN_LLM_POPULATION = 50
+
+chunk_inputs = []
+for chunk_num, ((_, summary), chunk_placename) in enumerate(zip(summaries.iterrows(), placenames), start=1):
+    print(f"Chunk {chunk_num} placename: {chunk_placename}")
+    chunk_id = f"{chunk_placename} (Chunk {chunk_num})"
+    chunk_populations.append({'Placename': chunk_id, 'Population': summary['sum']})
+    if summary['sum'] < MIN_LLM_POPULATION:
+        print(f"Skipping LLM for sparsely populated chunk {chunk_id}.")
+        reports.append((chunk_num, chunk_placename, f"Uninhabited region ({summary['sum']:.0f} pop)."))
         continue
-
-    summary = chunk['PopEst2023'].agg(['mean', 'sum', 'max', 'min']).to_frame().T
-    csv_text = summary.to_csv(index=False, float_format='%.2f')
-
-    chunk_id = f"{chunk_placename} (Chunk {i+1})"
-    chunk_populations.append({'Placename': chunk_id, 'Population': summary['sum'].iloc[0]})
-
-    # --- LLM Calls ---
+    csv_text = summary.to_frame().T.to_csv(index=False, float_format='%.2f')
+    chunk_inputs.append((chunk_num, chunk_placename, chunk_id, csv_text))
+
+# Pass 2: LLM calls for all chunks, issued concurrently.
+# Requests are binned by expected output length (livability is a single integer,
+# analysis a paragraph, policy several) and each bin is gathered separately, so
+# short decodes are not held back by long ones in the same batch.
+# The livability answer is constrained to a small JSON object ({"score": 73}),
+# so its decode is capped hard and made deterministic.
+LIVABILITY_OPTIONS = {'num_predict': 16, 'temperature': 0}
+LIVABILITY_SCHEMA = {
+    'type': 'object',
+    'properties': {'score': {'type': 'integer', 'minimum': 1, 'maximum': 100}},
+    'required': ['score'],
+}
+ANALYSIS_OPTIONS = {'num_predict': 512}
+POLICY_OPTIONS = {'num_predict': 768}
+
+def build_prompts(chunk_placename, csv_text):
     analysis_prompt = f"""Based ONLY on the data provided in the CSV below for {chunk_placename}, summarize the population trends and centers. Do not use any external knowledge or statistics.
 CSV:
 {csv_text}"""
-    content = generate_text(analysis_prompt)
-    reports.append((i+1, chunk_placename, content))
-    time.sleep(2)
-
     policy_prompt = f"""Based ONLY on the demographic summary CSV provided for {chunk_placename}, provide 3-5 detailed policy recommendations. For each, state the 'Problem' and a 'Specific Proposal'. Do not use external knowledge.
 CSV:
 {csv_text}"""
-    policy_content = generate_text(policy_prompt)
-    policy_suggestions.append((i+1, chunk_placename, policy_content))
-    time.sleep(2)
-
-    livability_prompt = f"""Based ONLY on the summary statistics below for a region in New Zealand, rate its 'livability' on a scale of 1 to 100. Consider factors like population density (mean) and size (sum). A good score might represent a place that is neither too crowded nor too sparse. Output ONLY a single integer number and nothing else.
+    livability_prompt = f"""Based ONLY on the summary statistics below for a region in New Zealand, rate its 'livability' on a scale of 1 to 100. Consider factors like population density (mean) and size (sum). A good score might represent a place that is neither too crowded nor too sparse. Respond with JSON of the form {{"score": <integer>}} and nothing else.
 CSV:
 {csv_text}"""
-    livability_score_text = generate_text(livability_prompt)
-    cleaned_score_text = clean_llm_output(livability_score_text)
-    score = 50 # Default score
+    return analysis_prompt, policy_prompt, livability_prompt
+
+async def process_all_chunks(inputs):
+    client = ollama.AsyncClient() if _LLM_OK and LLM_BACKEND == "ollama" else None
+    semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+    short_reqs, medium_reqs, long_reqs = [], [], []
+    for _, placename, _, csv_text in inputs:
+        analysis_prompt, policy_prompt, livability_prompt = build_prompts(placename, csv_text)
+        short_reqs.append(livability_prompt)
+        medium_reqs.append(analysis_prompt)
+        long_reqs.append(policy_prompt)
+
+    livability_texts = await asyncio.gather(
+        *(generate_text(client, semaphore, p, LIVABILITY_OPTIONS, LIVABILITY_SCHEMA) for p in short_reqs)
+    )
+    analysis_texts = await asyncio.gather(
+        *(generate_text(client, semaphore, p, ANALYSIS_OPTIONS) for p in medium_reqs)
+    )
+    policy_texts = await asyncio.gather(
+        *(generate_text(client, semaphore, p, POLICY_OPTIONS) for p in long_reqs)
+    )
+    return list(zip(analysis_texts, policy_texts, livability_texts))
+
+print(f"--- Querying LLM for {len(chunk_inputs)} chunks (concurrency: {LLM_CONCURRENCY}) ---")
+llm_results = asyncio.run(process_all_chunks(chunk_inputs))
+
+for (chunk_num, chunk_placename, chunk_id, _), (content, policy_content, livability_score_text) in zip(chunk_inputs, llm_results):
+    reports.append((chunk_num, chunk_placename, content))
+    policy_suggestions.append((chunk_num, chunk_placename, policy_content))
+
     try:
-        # Find all numbers in the cleaned text
-        potential_scores = re.findall(r'\d+', cleaned_score_text)
-        
-        # Find the first valid score in the list
-        for num_str in potential_scores:
-            num = int(num_str)
-            if 1 <= num <= 100:
-                score = num
-                break # Stop after finding the first valid score
-        else: # This 'else' belongs to the 'for' loop
-            print(f"Warning: No valid score found in LLM output. Defaulting to 50.")
-
-    except (ValueError, TypeError):
-        print(f"Warning: Error parsing LLM output. Defaulting to 50.")
-        score = 50 # Ensure score is 50 on any parsing error
+        # clean_llm_output is a no-op on plain JSON; it only unwraps a response repr
+        score = json.loads(clean_llm_output(livability_score_text))['score']
+        if not (isinstance(score, int) and 1 <= score <= 100):
+            raise ValueError(f"score out of range: {score!r}")
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Warning: Could not parse livability score from LLM output ({e}). Defaulting to 50.")
+        score = 50 # Default score
     chunk_livability.append({'Placename': chunk_id, 'Livability': score})
-    print(f"Livability score generated: {score}")
-    time.sleep(2)
+    print(f"Livability score generated for {chunk_id}: {score}")
+
+# Templated reports for skipped chunks were added first; restore chunk order
+reports.sort(key=lambda report: report[0])
 
 # --- Visualization ---
 print("--- Generating Visualizations ---")
 
+def add_polygon_collection(ax, gdf, column, cmap):
+    """Draw polygons (including holes) as a single PathCollection instead of one artist per geometry."""
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    if not (gdf.geom_type == 'Polygon').all():
+        # make_valid can yield GeometryCollections with line/point parts; keep
+        # only polygon parts so paths and colour values stay aligned
+        gdf = gdf.explode(index_parts=False)
+        gdf = gdf[(gdf.geom_type == 'Polygon') & ~gdf.geometry.is_empty]
+
+    # Exterior ring first, then holes; consecutive rings share a polygon index
+    rings, poly_index = shapely.get_rings(gdf.geometry.values, return_index=True)
+    coords, ring_index = shapely.get_coordinates(rings, return_index=True)
+    ring_coords = np.split(coords, np.flatnonzero(np.diff(ring_index)) + 1)
+    # Agg fills with the non-zero winding rule, so holes must wind opposite to
+    # exteriors: exteriors counter-clockwise, holes clockwise
+    is_exterior = np.r_[True, poly_index[1:] != poly_index[:-1]]
+    needs_reverse = shapely.is_ccw(rings) != is_exterior
+
+    paths = []
+    for ring_ids in np.split(np.arange(len(rings)), np.flatnonzero(np.diff(poly_index)) + 1):
+        parts = [Path(ring_coords[r][::-1] if needs_reverse[r] else ring_coords[r], closed=True) for r in ring_ids]
+        paths.append(Path.make_compound_path(*parts))
+
+    collection = PathCollection(paths, array=gdf[column].to_numpy(), cmap=cmap, linewidths=0)
+    ax.add_collection(collection)
+    return collection
+
+# One figure is reused for every chart. Each chart is encoded to an in-memory
+# PNG once; the same bytes are written out as an artifact and embedded in the PDF.
+fig, ax = plt.subplots(1, 1, figsize=(10, 10))
+image_buffers = {}
+
+def reset_figure(figsize):
+    for extra_ax in fig.axes:
+        if extra_ax is not ax:  # e.g. the heatmap colorbar
+            extra_ax.remove()
+    ax.clear()
+    ax.set_axis_on()
+    ax.set_aspect('auto')
+    fig.set_size_inches(*figsize)
+
+def save_figure(path):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=150)
+    with open(path, 'wb') as f:
+        f.write(buf.getvalue())
+    buf.seek(0)
+    image_buffers[path] = buf
+
 # Heatmap
 heatmap_path = "population_density_map.png"
+COARSE_CELL_SIZE = 2500  # metres (NZTM); 10 x 10 grid cells per plotted block
 try:
-    grid['population_density'] = grid['PopEst2023']
-    fig, ax = plt.subplots(1, 1, figsize=(10, 10))
-    
+    # At national extent most 250m cells are sub-pixel, so dissolve them into
+    # coarser blocks before plotting. The original grid is left for analytics.
+    plot_cells = grid.loc[grid['CENTROID_X'].notna() & grid['CENTROID_Y'].notna(), ['PopEst2023', 'CENTROID_X', 'CENTROID_Y', 'geometry']]
+    plot_cells = plot_cells.assign(
+        coarse=(plot_cells['CENTROID_X'] // COARSE_CELL_SIZE).astype(int) * 10000
+        + (plot_cells['CENTROID_Y'] // COARSE_CELL_SIZE).astype(int)
+    )
+    coarse = plot_cells[['coarse', 'PopEst2023', 'geometry']].dissolve(by='coarse', aggfunc={'PopEst2023': 'sum'})
+    coarse['population_density'] = coarse['PopEst2023']
+    reset_figure((10, 10))
+
     # Explicitly set plot extent based on total_bounds
-    minx, miny, maxx, maxy = grid.total_bounds
+    minx, miny, maxx, maxy = coarse.total_bounds
     ax.set_xlim(minx, maxx)
     ax.set_ylim(miny, maxy)
 
-    grid.plot(column='population_density', cmap='OrRd', legend=True, ax=ax, legend_kwds={'shrink': 0.8}) # Original plot
-    ax.set_title("NZ 250m Grid Population Density") # Original title
+    if _DATASHADER_OK:
+        # Rasterise all cells in native code rather than one matplotlib artist per polygon
+        plot_width = 2000
+        plot_height = int(plot_width * (maxy - miny) / (maxx - minx))
+        cvs = ds.Canvas(plot_width=plot_width, plot_height=plot_height, x_range=(minx, maxx), y_range=(miny, maxy))
+        agg = cvs.polygons(coarse, geometry='geometry', agg=ds.mean('population_density'))
+        img = ds.tf.shade(agg, cmap=plt.cm.OrRd, how='linear')
+        ax.imshow(img.to_pil(), extent=(minx, maxx, miny, maxy), origin='upper')
+        norm = plt.Normalize(vmin=float(agg.min()), vmax=float(agg.max()))
+        fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap='OrRd'), ax=ax, shrink=0.8)
+    else:
+        collection = add_polygon_collection(ax, coarse, 'population_density', 'OrRd')
+        # NZTM is projected in metres; keep the map's true proportions
+        ax.set_aspect('equal')
+        fig.colorbar(collection, ax=ax, shrink=0.8)
+    ax.set_title(f"NZ Population Density ({COARSE_CELL_SIZE / 1000:g} km blocks of the 250m grid)")
     ax.set_axis_off()
     plt.tight_layout()
-    plt.savefig(heatmap_path, dpi=150)
-    plt.close(fig)
+    save_figure(heatmap_path)
     print(f"Heatmap saved to {heatmap_path}")
 except Exception as e:
     print(f"Error generating heatmap: {e}")
@@ -230,8 +489,8 @@ if chunk_populations:
     try:
         chunks_df = pd.DataFrame(chunk_populations)
         top_chunks_df = chunks_df.nlargest(5, 'Population')
-        
-        fig, ax = plt.subplots(figsize=(10, 6))
+
+        reset_figure((10, 6))
         sns.barplot(x='Placename', y='Population', data=top_chunks_df, hue='Placename', palette="viridis", dodge=False, ax=ax)
         
         def k_formatter(x, pos):
@@ -243,8 +502,7 @@ if chunk_populations:
         ax.set_xlabel("Chunk Placename")
         plt.xticks(rotation=45, ha='right')
         plt.tight_layout()
-        plt.savefig(pop_bar_path, dpi=150)
-        plt.close(fig)
+        save_figure(pop_bar_path)
         print(f"Population bar chart saved to {pop_bar_path}")
     except Exception as e:
         print(f"Error generating population bar chart: {e}")
@@ -256,7 +514,7 @@ if chunk_livability:
         livability_df = pd.DataFrame(chunk_livability)
         top_livability_df = livability_df.nlargest(5, 'Livability')
 
-        fig, ax = plt.subplots(figsize=(10, 6))
+        reset_figure((10, 6))
         sns.barplot(x='Placename', y='Livability', data=top_livability_df, hue='Placename', palette="plasma", dodge=False, ax=ax)
         ax.set_ylim(0, 100)
         ax.set_title("Top 5 Most 'Livable' Chunks (AI-Generated Score)")
@@ -264,12 +522,13 @@ if chunk_livability:
         ax.set_xlabel("Chunk Placename")
         plt.xticks(rotation=45, ha='right')
         plt.tight_layout()
-        plt.savefig(livability_bar_path, dpi=150)
-        plt.close(fig)
+        save_figure(livability_bar_path)
         print(f"Livability bar chart saved to {livability_bar_path}")
     except Exception as e:
         print(f"Error generating livability bar chart: {e}")
 
+plt.close(fig)
+
 # --- PDF Generation ---
 print("--- Generating PDF Report ---")
 
@@ -285,13 +544,39 @@ except NameError:
 dejavu_regular = os.path.join(script_dir, "DejaVuSans.ttf")
 dejavu_bold = os.path.join(script_dir, "DejaVuSans-Bold.ttf")
 
+# LLM output is cleaned once up front so the font choice below can inspect it
+cleaned_reports = [(num, placename, clean_llm_output(text)) for num, placename, text in reports]
+cleaned_policies = [(num, placename, clean_llm_output(text)) for num, placename, text in policy_suggestions]
+
+def is_latin1(text: str) -> bool:
+    try:
+        text.encode('latin-1')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+# The core Helvetica font needs no TTF parsing but only covers Latin-1, so the
+# DejaVu TTFs are parsed only when some report text (e.g. a macron in a
+# placename) actually needs them.
+needs_unicode_font = not all(
+    is_latin1(text)
+    for _, placename, body in cleaned_reports + cleaned_policies
+    for text in (placename, body)
+)
+
 font_family = "Helvetica"
-try:
-    pdf.add_font("DejaVuSans", "", dejavu_regular)
-    pdf.add_font("DejaVuSans", "B", dejavu_bold)
-    font_family = "DejaVuSans"
-except Exception as e:
-    print(f"Warning: Could not load DejaVuSans font ({e}). Falling back to Helvetica.")
+if needs_unicode_font:
+    if os.path.exists(dejavu_regular) and os.path.exists(dejavu_bold):
+        pdf.add_font("DejaVuSans", "", dejavu_regular)
+        pdf.add_font("DejaVuSans", "B", dejavu_bold)
+        font_family = "DejaVuSans"
+    else:
+        print(f"Warning: DejaVuSans font files not found in {script_dir}. Falling back to Helvetica; non Latin-1 characters will be replaced.")
+
+def pdf_text(text: str) -> str:
+    if font_family == "Helvetica":
+        return text.encode('latin-1', 'replace').decode('latin-1')
+    return text
 
 pdf.add_page()
 pdf.set_font(font_family, 'B', 16)
@@ -301,14 +586,14 @@ pdf.ln(10)
 # Insert images
 image_paths = [heatmap_path, pop_bar_path, livability_bar_path]
 for img_path in image_paths:
-    if os.path.exists(img_path):
+    if img_path in image_buffers:
         try:
-            pdf.image(img_path, x=15, w=180)
+            pdf.image(image_buffers[img_path], x=15, w=180)
             pdf.ln(10)
         except Exception as e:
             print(f"Warning: Could not add image {img_path} to PDF: {e}")
     else:
-        print(f"Warning: Image file not found: {img_path}")
+        print(f"Warning: Image was not generated: {img_path}")
 
 # Livability explanation
 pdf.add_page()
@@ -320,31 +605,31 @@ explanation_text = ("The 'livability' score is an experimental metric. It is gen
 pdf.multi_cell(0, 6, explanation_text)
 
 # LLM reports
-for chunk_num, chunk_placename, text in reports:
+for chunk_num, chunk_placename, cleaned_text in cleaned_reports:
     pdf.add_page()
     pdf.set_font(font_family, 'B', 14)
     print(f"DEBUG: Writing placename to PDF reports section: {chunk_placename}")
-    pdf.cell(0, 10, f"Chunk {chunk_num} ({chunk_placename}) Analysis Report", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.cell(0, 10, pdf_text(f"Chunk {chunk_num} ({chunk_placename}) Analysis Report"), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(5)
     pdf.set_font(font_family, '', 12)
-    cleaned_text = clean_llm_output(text)
-    pdf.multi_cell(0, 6, cleaned_text)
+    pdf.multi_cell(0, 6, pdf_text(cleaned_text))
 
 # LLM policy proposals
-for chunk_num, chunk_placename, policy_text in policy_suggestions:
+for chunk_num, chunk_placename, cleaned_policy in cleaned_policies:
     pdf.add_page()
     pdf.set_font(font_family, 'B', 14)
-    pdf.cell(0, 10, f"Chunk {chunk_num} ({chunk_placename}) Policy Proposal Summary", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.cell(0, 10, pdf_text(f"Chunk {chunk_num} ({chunk_placename}) Policy Proposal Summary"), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(5)
     pdf.set_font(font_family, '', 12)
-    cleaned_policy = clean_llm_output(policy_text)
-    pdf.multi_cell(0, 6, cleaned_policy)
+    pdf.multi_cell(0, 6, pdf_text(cleaned_policy))
     pdf.ln(5)
 
 # Metadata footer
 pdf.add_page()
 pdf.set_font(font_family, '', 10)
-meta_text = f"Generated automatically using Ollama LLM ({model_name}) and OpenStreetMap.\nDate: {datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
+llm_label = "llama.cpp server" if LLM_BACKEND == "llamacpp" else "Ollama LLM"
+geocoder_label = "OpenStreetMap" if used_nominatim else f"place boundaries from {os.path.basename(PLACES_PATH)}"
+meta_text = f"Generated automatically using {llm_label} ({model_name}) and {geocoder_label}.\nDate: {datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
 pdf.multi_cell(0, 6, meta_text)
 
 # Save final PDF
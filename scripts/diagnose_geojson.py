@@ -1,14 +1,17 @@
 import geopandas as gpd
+import shapely
 import os
 
 # --- Configuration ---
 # Relative path to the GeoJSON file from this script
 GEOJSON_FILE_PATH = '../data/nz_population.geojson'
+# GeoParquet written by preprocess_population.py (checked instead when present)
+GEOPARQUET_FILE_PATH = '../data/nz_population.parquet'
 # ---
 
 def diagnose_geojson(file_path):
     """
-    Reads a GeoJSON file and checks for invalid or empty geometries.
+    Reads a GeoJSON or GeoParquet file and checks for invalid or empty geometries.
     """
     print(f"--- Starting Diagnosis: {file_path} ---")
 
@@ -20,40 +23,50 @@ def diagnose_geojson(file_path):
 
     # Read the file
     try:
-        gdf = gpd.read_file(file_path)
+        # Only geometries are checked, so skip parsing all attribute columns
+        if file_path.endswith('.parquet'):
+            gdf = gpd.read_parquet(file_path, columns=['geometry'])
+        else:
+            gdf = gpd.read_file(file_path, engine="pyogrio", columns=[])
         print(f"File read successfully. Found {len(gdf)} features.")
     except Exception as e:
         print(f"Error reading file: {e}")
-        print("The file might be corrupted or not a valid GeoJSON format.")
+        print("The file might be corrupted or not a valid GeoJSON/GeoParquet format.")
         return
 
     # --- Checking Geometries ---
     print("\n--- Checking Geometries ---")
 
+    # Both checks run as single vectorized shapely passes over the geometry array
+    geometries = gdf.geometry.values
+
     # 1. Check for empty geometries
-    empty_geometries = gdf[gdf.geometry.is_empty]
-    if not empty_geometries.empty:
-        print(f"Warning: Found {len(empty_geometries)} empty geometries.")
+    empty_count = int(shapely.is_empty(geometries).sum())
+    if empty_count:
+        print(f"Warning: Found {empty_count} empty geometries.")
     else:
         print("No empty geometries were found.")
 
     # 2. Check for invalid geometries
-    invalid_geometries = gdf[~gdf.geometry.is_valid]
-    if not invalid_geometries.empty:
-        print(f"★ PROBLEM FOUND ★: Found {len(invalid_geometries)} invalid geometries.")
+    invalid_count = int((~shapely.is_valid(geometries)).sum())
+    if invalid_count:
+        print(f"★ PROBLEM FOUND ★: Found {invalid_count} invalid geometries.")
         print("This is almost certainly the reason for map rendering failures.")
     else:
         print("All geometries are valid.")
 
     print("\n--- Diagnosis Complete ---")
-    if not invalid_geometries.empty:
+    if invalid_count:
         print("Conclusion: Invalid geometries were found. This is very likely the cause of the choropleth map not displaying.")
         print("Suggestion: Open the file in a GIS tool like QGIS and run the 'Fix geometries' algorithm.")
-    elif not empty_geometries.empty:
+    elif empty_count:
         print("Conclusion: Empty geometries were found. This could also be a potential cause of issues.")
     else:
         print("Conclusion: No obvious geometry errors were found in this basic check. The issue might be more complex (e.g., overly complex shapes).")
 
 
 if __name__ == '__main__':
-    diagnose_geojson(GEOJSON_FILE_PATH)
\ No newline at end of file
+    if os.path.exists(GEOPARQUET_FILE_PATH):
+        diagnose_geojson(GEOPARQUET_FILE_PATH)
+    else:
+        diagnose_geojson(GEOJSON_FILE_PATH)
\ No newline at end of file
@@ -1,12 +1,32 @@
 import requests
 import json
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+# Optional fast JSON (orjson); falls back to the stdlib parser
+try:
+    import orjson  # type: ignore
+    _ORJSON_OK = True
+except ImportError:
+    orjson = None
+    _ORJSON_OK = False
+
+def json_loads(data: bytes):
+    return orjson.loads(data) if _ORJSON_OK else json.loads(data)
+
+def json_dumps(obj) -> str:
+    return orjson.dumps(obj).decode() if _ORJSON_OK else json.dumps(obj)
 
 # ==========================================
 # Settings
 # ==========================================
 API_URL = "https://services2.arcgis.com/vKb0s8tBIA3bdocZ/arcgis/rest/services/NZGrid_250m_ERP/FeatureServer/1/query"
 OUTPUT_PATH = "../data/nz_population.geojson"
+PAGE_SIZE = 2000      # Number of records to fetch at once
+MAX_WORKERS = 8       # Concurrent page requests (kept modest to respect the server)
+ORDER_BY_FIELD = "OBJECTID"  # Stable sort key so concurrent offset pages neither overlap nor skip rows
 
 # ==========================================
 # Query Parameters
@@ -16,46 +36,86 @@ params = {
     "outFields": "*",        # All fields
     "f": "geojson",          # GeoJSON format
     "outSR": "4326",         # WGS84 coordinates
-    "resultOffset": 0,       # Paging support (offset)
-    "resultRecordCount": 2000  # Number of records to fetch at once
+    "orderByFields": ORDER_BY_FIELD,
+    "resultRecordCount": PAGE_SIZE
 }
 
+def check_arcgis_error(data):
+    # ArcGIS reports query errors as an HTTP 200 response with an "error" body
+    if "error" in data:
+        error = data["error"]
+        raise RuntimeError(f"ArcGIS API error {error.get('code')}: {error.get('message')} {error.get('details', '')}")
+
 # ==========================================
-# Paging
+# Record count
 # ==========================================
-features = []
 print("📡 Fetching data from Stats NZ ArcGIS API...")
 
-while True:
-    res = requests.get(API_URL, params=params)
-    res.raise_for_status()
-    data = res.json()
-
-    # Add the fetched features
-    batch = data.get("features", [])
-    features.extend(batch)
-
-    print(f"   → Retrieved {len(batch)} records (Total: {len(features)})")
-
-    # Check if there is a next page
-    if len(batch) < params["resultRecordCount"]:
-        break
-    else:
-        params["resultOffset"] += params["resultRecordCount"]
-
-print(f"✅ All data fetched: {len(features)} features")
+res = requests.get(API_URL, params={"where": "1=1", "returnCountOnly": "true", "f": "json"})
+res.raise_for_status()
+data = res.json()
+check_arcgis_error(data)
+total = data["count"]
+offsets = list(range(0, total, PAGE_SIZE))
+print(f"   → {total} records in {len(offsets)} pages")
 
 # ==========================================
-# Save
+# Paging (concurrent)
 # ==========================================
-geojson_data = {
-    "type": "FeatureCollection",
-    "features": features
-}
+session = requests.Session()
+
+def fetch_page(offset):
+    res = session.get(API_URL, params={**params, "resultOffset": offset})
+    res.raise_for_status()
+    data = json_loads(res.content)
+    check_arcgis_error(data)
+    batch = data.get("features", [])
+    print(f"   → Retrieved {len(batch)} records (offset {offset})")
 
+    # Only the last page may be short. A short earlier page (usually flagged with
+    # exceededTransferLimit) means the server's maxRecordCount is below PAGE_SIZE
+    # and records between pages would be silently lost.
+    if offset + PAGE_SIZE < total and len(batch) < PAGE_SIZE:
+        exceeded = data.get("exceededTransferLimit") or data.get("properties", {}).get("exceededTransferLimit")
+        raise RuntimeError(
+            f"Page at offset {offset} returned {len(batch)} of {PAGE_SIZE} records "
+            f"(exceededTransferLimit={bool(exceeded)}). Lower PAGE_SIZE to the server's maxRecordCount."
+        )
+    return batch
+
+# Features are streamed to a temporary file as pages arrive, keeping at most
+# PAGE_WINDOW pages in flight or waiting to be written. The existing output is
+# only replaced once every page has been fetched and the count checks out.
+PAGE_WINDOW = MAX_WORKERS * 2
+tmp_path = OUTPUT_PATH + ".tmp"
 os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-    json.dump(geojson_data, f)
+feature_count = 0
+try:
+    with open(tmp_path, "w", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        f.write('{"type":"FeatureCollection","features":[')
+        remaining = iter(offsets)
+        pending = deque(executor.submit(fetch_page, offset) for offset in islice(remaining, PAGE_WINDOW))
+        # Pages are consumed in offset order, so features keep the server's ordering
+        while pending:
+            batch = pending.popleft().result()
+            next_offset = next(remaining, None)
+            if next_offset is not None:
+                pending.append(executor.submit(fetch_page, next_offset))
+            for feature in batch:
+                if feature_count:
+                    f.write(",")
+                f.write(json_dumps(feature))
+                feature_count += 1
+        f.write("]}")
+
+    if feature_count != total:
+        raise RuntimeError(f"Fetched {feature_count} features but the API reported {total} records.")
+    os.replace(tmp_path, OUTPUT_PATH)
+except BaseException:
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    raise
 
+print(f"✅ All data fetched: {feature_count} features")
 print(f"💾 Saved to {OUTPUT_PATH}")
 
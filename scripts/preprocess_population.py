@@ -2,13 +2,13 @@
 import geopandas as gpd
 import pandas as pd
 
-# 1. Load data
+# 1. Load data (only the attribute columns we need are parsed)
 input_file = '../data/nz_population.geojson'
-gdf = gpd.read_file(input_file)
+gdf = gpd.read_file(input_file, engine="pyogrio", columns=['GridID', 'PopEst2023', 'CENTROID_X', 'CENTROID_Y'])
 
 # 2. Extract only necessary columns
-columns_needed = ['GridID', 'PopEst2023', 'geometry']
-gdf = gdf[columns_needed]
+columns_needed = ['GridID', 'PopEst2023', 'CENTROID_X', 'CENTROID_Y', 'geometry']
+gdf = gdf[[c for c in columns_needed if c in gdf.columns]]
 
 # 3. Check for missing values
 print("Missing values per column:")
@@ -34,10 +34,10 @@ print(f"Average population per grid: {avg_pop:,.2f}")
 print(f"Max population in a grid: {max_pop:,}")
 print(f"Min population in a grid: {min_pop:,}")
 
-# 7. Save to CSV (for later visualization and clustering)
-output_csv = '../data/nz_population_preprocessed.csv'
-gdf.to_csv(output_csv, index=False)
-print(f"\nPreprocessed data saved to: {output_csv}")
+# 7. Save to GeoParquet (columnar, compressed; read by the analysis scripts)
+output_parquet = '../data/nz_population.parquet'
+gdf.to_parquet(output_parquet, compression='zstd')
+print(f"\nPreprocessed data saved to: {output_parquet}")
 
 
 